@@ -1,14 +1,28 @@
-import io
+import asyncio
+import calendar
+import csv
+import functools
 import logging
+import math
 import os
+import random
+import shutil
+import socket
+import tempfile
+import threading
 import time
 import zipfile
 import traceback
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
 import pytz
+import aiohttp
 import requests
-import requests.adapters
-import pandas as pd
+import numpy as np
+import orjson
+import pyarrow as pa
+import pyarrow.compute as pc
+from pyarrow import csv as pacsv
 from breeze_connect import BreezeConnect
 from dotenv import load_dotenv
 
@@ -69,24 +83,121 @@ if not all([API_KEY, SECRET_KEY, SESSION_TOKEN, CONVEX_URL]):
     )
     exit(1)
 
-# A set of market holidays from environment variable (comma-separated YYYY-MM-DD).
+# Indian Standard Time, the timezone of both the exchange and Breeze bar timestamps
+IST = pytz.timezone('Asia/Kolkata')
+IST_OFFSET_SECONDS = 5 * 3600 + 30 * 60  # Fixed UTC+5:30, India has no DST
+
+# Market holidays from environment variable (comma-separated YYYY-MM-DD), stored as
+# date ordinals so holiday checks are integer lookups rather than strftime calls.
 holidays_str = os.getenv("MARKET_HOLIDAYS", "")
-HOLIDAYS = set(holidays_str.split(',')) if holidays_str else set()
-
-# The new endpoint for OHLCV data
-INGEST_URL = f"{CONVEX_URL}/ingestOhlcv"
-
-# Configure session with optimized connection pool
-session = requests.Session()
-session.headers.update({"Content-Type": "application/json"})
-adapter = requests.adapters.HTTPAdapter(
-    pool_connections=20,
-    pool_maxsize=100,
-    max_retries=1,
-    pool_block=False
-)
-session.mount('http://', adapter)
-session.mount('https://', adapter)
+try:
+    HOLIDAY_ORDINALS = frozenset(
+        date.fromisoformat(s.strip()).toordinal() for s in holidays_str.split(',') if s.strip()
+    )
+except ValueError as e:
+    logging.error(f"FATAL: MARKET_HOLIDAYS must be a comma-separated list of YYYY-MM-DD dates: {e}")
+    exit(1)
+
+# Bulk endpoint that accepts a whole batch of bars in one request
+INGEST_URL_BULK = f"{CONVEX_URL}/ingestOhlcvBulk"
+
+# Maximum number of bars buffered for the background uploader before the oldest are dropped
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "10000"))
+
+# Maximum number of bulk POSTs in flight to Convex at the same time
+INGEST_CONCURRENCY = int(os.getenv("INGEST_CONCURRENCY", "16"))
+
+# Upper bound on bars per bulk POST. At ~150 bytes of JSON per bar this keeps each
+# request body well under 64 KiB and each Convex mutation small.
+MAX_BATCH_BARS = int(os.getenv("MAX_BATCH_BARS", "256"))
+
+# How long the batcher waits after the first bar to collect more into the same batch
+BATCH_WINDOW_SECONDS = float(os.getenv("BATCH_WINDOW_SECONDS", "0.2"))
+
+# Pause before re-queueing a batch that could not be delivered to Convex
+RESEND_DELAY_SECONDS = 1
+
+# Send buffer for upload sockets; large enough that bursts of bulk POSTs never stall on it
+INGEST_SNDBUF_BYTES = 1 << 20
+
+# Transient failures are retried with exponential backoff plus jitter before giving up
+INGEST_MAX_RETRIES = 3
+RETRY_BACKOFF_SECONDS = 0.2
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+
+def _read_master_file(path):
+    """
+    Reads the 'Series' and 'Token' columns of the NSE scrip master into an Arrow table of strings.
+    Header names and values in the file may carry stray quotes or whitespace, so both are normalized.
+    Rows Arrow cannot split (e.g. a quoted field containing a comma after a leading space) are
+    re-parsed with the csv module instead of failing the whole file.
+    """
+    with open(path, "r", encoding="utf-8-sig") as f:
+        header = f.readline()
+    column_names = [c.strip().strip('"').strip() for c in header.split(',')]
+    include_columns = ["Series", "Token"]
+    for name in include_columns:
+        if name not in column_names:
+            # Fail before parsing: with a column missing, Arrow would read the wrong columns (or all of them)
+            logging.error(f"Columns found: {column_names}")
+            raise KeyError(name)
+
+    recovered = {name: [] for name in include_columns}
+    unparsed = []
+
+    def handle_invalid_row(row):
+        fields = next(csv.reader([row.text], skipinitialspace=True), [])
+        if len(fields) == len(column_names):
+            for name in include_columns:
+                recovered[name].append(fields[column_names.index(name)])
+        else:
+            unparsed.append(row.text)
+        return "skip"
+
+    tbl = pacsv.read_csv(
+        path,
+        read_options=pacsv.ReadOptions(column_names=column_names, skip_rows=1),
+        parse_options=pacsv.ParseOptions(delimiter=',', invalid_row_handler=handle_invalid_row),
+        convert_options=pacsv.ConvertOptions(
+            include_columns=include_columns,
+            column_types={"Series": pa.string(), "Token": pa.string()},
+        ),
+    )
+    if unparsed:
+        logging.warning(f"Skipped {len(unparsed)} unparseable row(s) in master file, e.g. {unparsed[0][:120]!r}")
+    if recovered["Token"]:
+        logging.info(f"Re-parsed {len(recovered['Token'])} irregular row(s) in master file.")
+        tbl = pa.concat_tables([tbl, pa.table({name: pa.array(values, pa.string()) for name, values in recovered.items()})])
+    return pa.table({name: pc.utf8_trim(tbl.column(name), characters=' "') for name in tbl.column_names})
+
+def _master_signature(path):
+    """
+    Returns the (mtime, size) pair that identifies a version of the master file.
+    """
+    st = os.stat(path)
+    return np.array([st.st_mtime, st.st_size], dtype=np.float64)
+
+def _load_cached_tokens(tokens_path, master_path):
+    """
+    Returns the token list saved for the current version of the master file,
+    or None if nothing was saved or the master file has changed since.
+    """
+    try:
+        with np.load(tokens_path) as cached:
+            if np.array_equal(cached["sig"], _master_signature(master_path)):
+                return cached["tok"].tolist()
+    except (OSError, KeyError, ValueError):
+        pass
+    return None
+
+def _save_cached_tokens(tokens_path, master_path, tokens):
+    """
+    Saves the parsed token list together with the signature of the master file it came from.
+    """
+    try:
+        np.savez(tokens_path, tok=np.asarray(tokens, dtype=np.int64), sig=_master_signature(master_path))
+    except OSError as e:
+        logging.warning(f"Could not cache parsed token list: {e}")
 
 def get_nse_cash_stock_tokens():
     """
@@ -99,6 +210,10 @@ def get_nse_cash_stock_tokens():
     MASTER_FILE_NAME = "NSEScripMaster.txt"
     CACHE_DIR = "./cache"
     CACHE_FILE_PATH = os.path.join(CACHE_DIR, MASTER_FILE_NAME)
+    # ETag/Last-Modified of the zip the cached master file was extracted from, used for conditional GETs
+    META_FILE_PATH = os.path.join(CACHE_DIR, "master.meta.json")
+    # Parsed token list, reused as long as the master file is unchanged
+    TOKENS_CACHE_PATH = os.path.join(CACHE_DIR, "tokens.npz")
     os.makedirs(CACHE_DIR, exist_ok=True)
 
     # Check if a recent cached version exists
@@ -107,138 +222,216 @@ def get_nse_cash_stock_tokens():
         file_mod_time = os.path.getmtime(CACHE_FILE_PATH)
         if time.time() - file_mod_time < cache_lifetime_hours * 60 * 60:
             logging.info(f"Using cached master file: {CACHE_FILE_PATH}")
-            df = pd.read_csv(CACHE_FILE_PATH, skipinitialspace=True)
-            df.columns = df.columns.str.strip().str.strip('"').str.strip()
         else:
             raise FileNotFoundError # File is too old, download a new one
     except (FileNotFoundError, OSError):
         logging.info(f"Downloading new master file from {NSE_MASTER_ZIP_URL}...")
+        tmp_zip_path = tmp_master_path = None
         try:
-            response = requests.get(NSE_MASTER_ZIP_URL, timeout=60)
-            response.raise_for_status()
-            with zipfile.ZipFile(io.BytesIO(response.content)) as thezip:
-                if MASTER_FILE_NAME not in thezip.namelist():
-                    logging.error(f"'{MASTER_FILE_NAME}' not found in the downloaded zip file.")
-                    return []
-                # Save the extracted file to cache
-                with thezip.open(MASTER_FILE_NAME) as source, open(CACHE_FILE_PATH, "wb") as target:
-                    target.write(source.read())
-
-            df = pd.read_csv(CACHE_FILE_PATH, skipinitialspace=True)
-            df.columns = df.columns.str.strip().str.strip('"').str.strip()
+            # If we still have a cached copy, only download the zip if it changed upstream
+            headers = {}
+            if os.path.exists(CACHE_FILE_PATH):
+                try:
+                    with open(META_FILE_PATH, "rb") as f:
+                        meta = orjson.loads(f.read())
+                    if meta.get("etag"):
+                        headers["If-None-Match"] = meta["etag"]
+                    if meta.get("last_modified"):
+                        headers["If-Modified-Since"] = meta["last_modified"]
+                except (OSError, ValueError):
+                    pass  # No usable validators, fall back to a full download
+
+            # Stream the zip to a temporary file instead of holding it in memory
+            with requests.get(NSE_MASTER_ZIP_URL, headers=headers, stream=True, timeout=60) as response:
+                if response.status_code == 304:
+                    logging.info("Master file unchanged on server. Reusing cached copy.")
+                    # Restart the cache lifetime, carrying the parsed token list over to the new mtime
+                    cached_tokens = _load_cached_tokens(TOKENS_CACHE_PATH, CACHE_FILE_PATH)
+                    os.utime(CACHE_FILE_PATH, None)
+                    if cached_tokens is not None:
+                        _save_cached_tokens(TOKENS_CACHE_PATH, CACHE_FILE_PATH, cached_tokens)
+                else:
+                    response.raise_for_status()
+                    meta = {
+                        "etag": response.headers.get("ETag"),
+                        "last_modified": response.headers.get("Last-Modified"),
+                    }
+                    response.raw.decode_content = True
+                    with tempfile.NamedTemporaryFile(dir=CACHE_DIR, suffix=".zip", delete=False) as tmp:
+                        tmp_zip_path = tmp.name
+                        shutil.copyfileobj(response.raw, tmp, 64 * 1024)
+
+            if tmp_zip_path is not None:
+                with zipfile.ZipFile(tmp_zip_path) as thezip:
+                    if MASTER_FILE_NAME not in thezip.namelist():
+                        logging.error(f"'{MASTER_FILE_NAME}' not found in the downloaded zip file.")
+                        return []
+                    # Extract next to the cache and swap it in, so a failed refresh never
+                    # leaves a truncated master file behind
+                    with thezip.open(MASTER_FILE_NAME) as source, \
+                            tempfile.NamedTemporaryFile(dir=CACHE_DIR, delete=False) as target:
+                        tmp_master_path = target.name
+                        shutil.copyfileobj(source, target, 64 * 1024)
+                os.replace(tmp_master_path, CACHE_FILE_PATH)
+                tmp_master_path = None
+
+                # Remember the validators so the next refresh can be a conditional GET
+                with open(META_FILE_PATH, "wb") as f:
+                    f.write(orjson.dumps(meta))
         except requests.exceptions.RequestException as e:
             logging.error(f"Failed to download NSE master zip file: {e}")
             return []
         except Exception as e:
             logging.error(f"Failed to process new master file: {e}")
             return []
-            
+        finally:
+            # Clean up temporary files, including those left by an interrupted download
+            for path in (tmp_zip_path, tmp_master_path):
+                if path is not None and os.path.exists(path):
+                    os.remove(path)
+
+    # Skip parsing entirely if the token list for this exact master file is already cached
+    tokens = _load_cached_tokens(TOKENS_CACHE_PATH, CACHE_FILE_PATH)
+    if tokens is not None:
+        logging.info(f"Found {len(tokens)} valid cash stocks in the cached token list.")
+        return tokens
+
     try:
-        # Filter for cash equities (Series == 'EQ') and where Token is not null
-        cash_stocks = df[df['Series'] == 'EQ'].copy()
-        
-        # Convert 'Token' column to numeric, coercing any non-numeric values to NaN.
-        cash_stocks['Token'] = pd.to_numeric(cash_stocks['Token'], errors='coerce')
-        
-        # Only filter out invalid tokens (0, NaN, or negative values)
-        valid_stocks = cash_stocks[
-            (cash_stocks['Token'].notna()) & 
-            (cash_stocks['Token'] > 0)
-        ].copy()
-        
-        # Remove the stock limiting logic completely
-        # Extract all valid tokens without any limit
-        tokens = valid_stocks['Token'].astype(int).tolist()
+        tbl = _read_master_file(CACHE_FILE_PATH)
+
+        # Convert 'Token' to int64 in Arrow. Only ASCII digit strings of up to 18 digits (which
+        # always fit in int64) are cast; anything else becomes null, which the mask below treats as invalid.
+        token_str = tbl.column('Token')
+        castable = pc.match_substring_regex(token_str, r"^[0-9]{1,18}$")
+        token = pc.cast(pc.if_else(castable, token_str, pa.scalar(None, pa.string())), pa.int64())
+
+        # Keep cash equities (Series == 'EQ') with a valid token (non-null and > 0) in one fused mask
+        mask = pc.and_(pc.equal(tbl.column('Series'), 'EQ'), pc.greater(token, 0))
+        tokens = token.filter(mask).to_pylist()
         logging.info(f"Found {len(tokens)} valid cash stocks in the master file.")
+        _save_cached_tokens(TOKENS_CACHE_PATH, CACHE_FILE_PATH, tokens)
         return tokens
     except KeyError as e:
         logging.error(f"Master file {CACHE_FILE_PATH} seems to be corrupted or has wrong format (missing column: {e}).")
-        logging.error(f"Columns found: {list(df.columns)}")
-        if os.path.exists(CACHE_FILE_PATH):
-            os.remove(CACHE_FILE_PATH)
+        for path in (CACHE_FILE_PATH, META_FILE_PATH):
+            if os.path.exists(path):
+                os.remove(path)
+        return []
+    except Exception as e:
+        logging.error(f"Failed to process master file: {e}")
         return []
 
-def is_market_session_time():
+def _is_trading_day(d):
     """
-    Checks if it's time to start the trading session (connect and subscribe).
-    Starts 15 minutes before market open for preparation.
+    Returns True if the given date is a weekday (Monday=0, Sunday=6) that is not a market holiday.
     """
-    try:
-        tz = pytz.timezone('Asia/Kolkata')
-        now = datetime.now(tz)
+    return d.weekday() <= 4 and d.toordinal() not in HOLIDAY_ORDINALS
 
-        # Check if it's a holiday
-        if now.strftime('%Y-%m-%d') in HOLIDAYS:
-            return False
+# Trading day boundaries as seconds after IST midnight
+SESSION_START_SECONDS = 9 * 3600              # 9:00 AM, 15 minutes before open for subscriptions
+MARKET_OPEN_SECONDS = 9 * 3600 + 15 * 60      # 9:15 AM
+MARKET_CLOSE_SECONDS = 15 * 3600 + 30 * 60    # 3:30 PM
+SESSION_END_SECONDS = 15 * 3600 + 40 * 60     # 3:40 PM, 10 minutes after close to capture final bars
 
-        # Check if it's a weekday (Monday=0, Sunday=6)
-        if now.weekday() > 4:
-            return False
+# (day_start, day_end, is_trading_day, session_start, market_open, market_close, session_end)
+# epochs for the current IST day; recomputed only when the date changes.
+_today_bounds = None
 
-        # Start session at 9:00 AM (15 minutes before market open for subscriptions)
-        session_start = now.replace(hour=9, minute=0, second=0, microsecond=0)
-        # End session at 3:40 PM (10 minutes after market close to capture final bars)
-        session_end = now.replace(hour=15, minute=40, second=0, microsecond=0)
+def _market_bounds(now_epoch):
+    """
+    Returns the cached trading-day bounds for the IST day containing now_epoch.
+    """
+    global _today_bounds
+    bounds = _today_bounds
+    if bounds is None or not (bounds[0] <= now_epoch < bounds[1]):
+        today = datetime.fromtimestamp(now_epoch, IST).date()
+        day_start = _day_epoch(today.isoformat())
+        is_trading_day = _is_trading_day(today)
+        bounds = _today_bounds = (
+            day_start,
+            day_start + 24 * 3600,
+            is_trading_day,
+            day_start + SESSION_START_SECONDS,
+            day_start + MARKET_OPEN_SECONDS,
+            day_start + MARKET_CLOSE_SECONDS,
+            day_start + SESSION_END_SECONDS,
+        )
+    return bounds
+
+# Single-slot [second, result] memos for the two market-hours checks
+_SESSION_TIME_CACHE = [0, False]
+_MARKET_OPEN_CACHE = [0, False]
 
-        return session_start <= now <= session_end
+def is_market_session_time():
+    """
+    Checks if it's time to start the trading session (connect and subscribe).
+    Starts 15 minutes before market open for preparation.
+    """
+    # The bounds are whole seconds, so the answer can only change on a whole-second
+    # boundary; reuse it within the same second
+    now = time.time()
+    second = int(now)
+    cache = _SESSION_TIME_CACHE
+    if cache[0] == second:
+        return cache[1]
+    try:
+        _, _, is_trading_day, session_start, _, _, session_end = _market_bounds(now)
+        cache[1] = is_trading_day and session_start <= now < session_end
+        cache[0] = second
+        return cache[1]
     except Exception as e:
         logging.warning(f"Could not determine session status due to an error: {e}. Assuming session is closed.")
         return False
 
-def is_market_open():
+def _is_market_open_at(now):
     """
-    Checks if the market is actually open for trading (9:15 AM to 3:30 PM IST).
-    Used to control when tick processing starts.
+    Checks if the market is open for trading at the given Unix time.
     """
+    # Called on every tick callback; the bounds are whole seconds, so reuse the answer within the same second
+    second = int(now)
+    cache = _MARKET_OPEN_CACHE
+    if cache[0] == second:
+        return cache[1]
     try:
-        tz = pytz.timezone('Asia/Kolkata')
-        now = datetime.now(tz)
-
-        # Check if it's a holiday
-        if now.strftime('%Y-%m-%d') in HOLIDAYS:
-            return False
-
-        # Check if it's a weekday (Monday=0, Sunday=6)
-        if now.weekday() > 4:
-            return False
-
-        market_open = now.replace(hour=9, minute=15, second=0, microsecond=0)
-        market_close = now.replace(hour=15, minute=30, second=0, microsecond=0)
-
-        return market_open <= now <= market_close
+        _, _, is_trading_day, _, market_open, market_close, _ = _market_bounds(now)
+        cache[1] = is_trading_day and market_open <= now < market_close
+        cache[0] = second
+        return cache[1]
     except Exception as e:
         logging.warning(f"Could not determine market status due to an error: {e}. Assuming market is closed.")
         return False
 
+def is_market_open():
+    """
+    Checks if the market is actually open for trading (9:15 AM to 3:30 PM IST).
+    Used to control when tick processing starts.
+    """
+    return _is_market_open_at(time.time())
+
 def get_next_market_opening():
     """
     Calculate the next market opening time (9:15 AM IST on the next trading day).
     Accounts for weekends and holidays.
     """
     try:
-        tz = pytz.timezone('Asia/Kolkata')
-        now = datetime.now(tz)
+        now = datetime.now(IST)
         
         # First check if today still has a session ahead
-        if now.weekday() <= 4:  # Monday to Friday
-            if now.strftime('%Y-%m-%d') not in HOLIDAYS:
-                # Check if today's session hasn't started yet (before 9:00 AM)
-                today_session_start = now.replace(hour=9, minute=0, second=0, microsecond=0)
-                if now < today_session_start:
-                    # Market opens later today
-                    return now.replace(hour=9, minute=15, second=0, microsecond=0)
+        if _is_trading_day(now.date()):
+            # Check if today's session hasn't started yet (before 9:00 AM)
+            today_session_start = now.replace(hour=9, minute=0, second=0, microsecond=0)
+            if now < today_session_start:
+                # Market opens later today
+                return now.replace(hour=9, minute=15, second=0, microsecond=0)
         
         # If today's session is over or it's weekend/holiday, check from tomorrow
         next_day = now + timedelta(days=1)
         
         while True:
-            # Check if it's a weekday (Monday=0, Sunday=6)
-            if next_day.weekday() <= 4:  # Monday to Friday
-                # Check if it's not a holiday
-                if next_day.strftime('%Y-%m-%d') not in HOLIDAYS:
-                    # This is a valid trading day
-                    market_open_time = next_day.replace(hour=9, minute=15, second=0, microsecond=0)
-                    return market_open_time
+            if _is_trading_day(next_day.date()):
+                # This is a valid trading day
+                market_open_time = next_day.replace(hour=9, minute=15, second=0, microsecond=0)
+                return market_open_time
             
             # Move to next day if weekend or holiday
             next_day += timedelta(days=1)
@@ -247,11 +440,240 @@ def get_next_market_opening():
         logging.warning(f"Could not calculate next market opening: {e}. Defaulting to 5-minute check.")
         return None
 
+# Payload fields copied from a Breeze tick and the type Convex expects for each
+_CAST = (
+    ("stock_code", str),
+    ("open", float),
+    ("high", float),
+    ("low", float),
+    ("close", float),
+    ("volume", int),
+    ("interval", str),
+)
+
+@functools.lru_cache(maxsize=32)
+def _day_epoch(day):
+    """
+    Returns the Unix timestamp of IST midnight for a 'YYYY-MM-DD' date string.
+    """
+    # IST is a fixed UTC+5:30 with no DST, so skip pytz's localize machinery entirely
+    return calendar.timegm((int(day[0:4]), int(day[5:7]), int(day[8:10]), 0, 0, 0)) - IST_OFFSET_SECONDS
+
+@functools.lru_cache(maxsize=4096)
+def _parse_ts(s):
+    """
+    Converts a Breeze 'YYYY-MM-DD HH:MM:SS' IST datetime string to a Unix timestamp.
+    Memoized because every subscribed stock reports the same bar time within an interval.
+    """
+    # The format is fixed, so slice the fields directly instead of going through strptime.
+    # IST has no DST, so the time of day is a plain offset from the cached midnight epoch.
+    return _day_epoch(s[0:10]) + int(s[11:13]) * 3600 + int(s[14:16]) * 60 + int(s[17:19])
+
+def _build_payload(tick):
+    """
+    Converts a single Breeze OHLCV tick into the payload our Convex backend expects.
+    Raises KeyError for a missing field, which includes items that are not OHLCV bars
+    (quotes, confirmations, ...), and TypeError or ValueError for bars with malformed fields.
+    """
+    # Convert the IST datetime string from Breeze to a Unix timestamp
+    timestamp = _parse_ts(tick["datetime"])
+
+    # Values that already have the right type are passed through without a cast
+    payload = {k: (v if type(v) is t else t(v)) for k, t in _CAST for v in (tick[k],)}
+    # NaN/inf prices would be encoded as null and rejected by Convex
+    if not all(map(math.isfinite, (payload["open"], payload["high"], payload["low"], payload["close"]))):
+        raise ValueError("non-finite price")
+    payload["timestamp"] = timestamp
+    return payload
+
+def _ingest_socket_factory(addr_info):
+    """
+    Creates the sockets aiohttp uses for Convex uploads: Nagle disabled so small bulk POSTs
+    are not held back waiting for delayed ACKs, and a larger send buffer.
+    """
+    family, type_, proto, _, _ = addr_info
+    sock = socket.socket(family=family, type=type_, proto=proto)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, INGEST_SNDBUF_BYTES)
+    return sock
+
+class _TokenBucket:
+    """
+    Thread-safe token bucket rate limiter: allows `rate` acquisitions per second on
+    average, with bursts of up to `capacity` back-to-back acquisitions.
+    """
+    def __init__(self, rate, capacity):
+        # acquire() could never collect a whole token with a smaller bucket and would spin forever
+        if capacity < 1:
+            raise ValueError(f"Token bucket capacity must be at least 1, got {capacity}")
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
 class Ingestor:
     def __init__(self):
         self.breeze = BreezeConnect(api_key=API_KEY)
-        self.last_seen_timestamps = {}  # Track last seen timestamp per stock
+        self.last_seen_timestamps = {}  # Track last seen timestamp per (stock, interval)
+        self.duplicate_bars = 0  # Replayed or out-of-order bars skipped before upload
         self.subscriptions_complete = False  # Flag to control tick processing
+        self.dropped_bars = 0  # Bars discarded because the upload queue was full
+
+        # Runs the master file download/parse off the critical path at the start of each session
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="master")
+
+        # Uploads run on a dedicated asyncio loop. on_ticks only hands payloads over to it, and
+        # a single batcher coroutine drains the queue into bulk batches that are POSTed with up
+        # to INGEST_CONCURRENCY in flight, so the WebSocket callback never waits on Convex.
+        self._loop = asyncio.new_event_loop()
+        self._loop_thread = threading.Thread(target=self._loop.run_forever, name="ingest-loop", daemon=True)
+        self._loop_thread.start()
+        asyncio.run_coroutine_threadsafe(self._start_uploads(), self._loop).result()
+
+    async def _start_uploads(self):
+        """
+        Creates the shared aiohttp session, the upload queue and the batcher coroutine;
+        must run on the ingest loop.
+        """
+        # One pooled connection per in-flight upload, so connections are reused rather than churned
+        connector = aiohttp.TCPConnector(
+            limit=INGEST_CONCURRENCY,
+            keepalive_timeout=60,
+            socket_factory=_ingest_socket_factory,
+        )
+        self._http = aiohttp.ClientSession(
+            connector=connector,
+            headers={"Content-Type": "application/json"},
+            timeout=aiohttp.ClientTimeout(total=10),
+        )
+        self._q = asyncio.Queue(maxsize=INGEST_QUEUE_SIZE)
+        self._upload_slots = asyncio.Semaphore(INGEST_CONCURRENCY)
+        self._uploads = set()  # Strong references to in-flight upload tasks
+        self._batcher = asyncio.create_task(self._batch_uploads(), name="ingest-batcher")
+
+    def _enqueue(self, payload):
+        """
+        Hands a payload to the ingest loop without blocking the calling thread.
+        """
+        self._loop.call_soon_threadsafe(self._put, payload)
+
+    def _put(self, payload):
+        """
+        Adds a payload to the upload queue; runs on the ingest loop. If the queue is full,
+        the oldest unprocessed bar is discarded to make room for the new one.
+        """
+        if self._q.full():
+            self._q.get_nowait()
+            self.dropped_bars += 1
+            logging.warning("Upload queue full, dropped oldest bar (%d dropped so far)", self.dropped_bars)
+        self._q.put_nowait(payload)
+
+    async def _batch_uploads(self):
+        """
+        Waits for a free upload slot and the first queued bar, lingers up to BATCH_WINDOW_SECONDS
+        for more to arrive, then drains everything waiting (up to MAX_BATCH_BARS) and hands it to
+        a new upload task. Only this coroutine takes bars off the queue, so bars from one burst
+        end up in the same batch; while every slot is busy, new bars accumulate into the next one.
+        """
+        while True:
+            await self._upload_slots.acquire()
+            batch = [await self._q.get()]
+            # Bars of the same interval arrive in a burst across several callbacks; give the
+            # rest of the burst a moment to show up unless a full batch is already waiting.
+            if self._q.qsize() < MAX_BATCH_BARS - 1:
+                await asyncio.sleep(BATCH_WINDOW_SECONDS)
+            while len(batch) < MAX_BATCH_BARS and not self._q.empty():
+                batch.append(self._q.get_nowait())
+            task = asyncio.create_task(self._post_batch(batch))
+            self._uploads.add(task)
+            task.add_done_callback(self._upload_done)
+
+    def _upload_done(self, task):
+        """
+        Frees the upload slot held by a finished upload task.
+        """
+        self._uploads.discard(task)
+        self._upload_slots.release()
+
+    async def _post_batch(self, payloads):
+        """
+        Sends a batch of bars to the Convex bulk endpoint and logs per-bar failures.
+        Transient errors are retried with exponential backoff and jitter, then re-queued if they persist.
+        """
+        # orjson encodes straight to bytes and is much faster than the stdlib encoder on float-heavy bars
+        body = orjson.dumps({"bars": payloads})
+
+        for attempt in range(INGEST_MAX_RETRIES + 1):
+            retries_left = attempt < INGEST_MAX_RETRIES
+            try:
+                # Send the whole batch to the Convex bulk endpoint in a single POST request
+                async with self._http.post(INGEST_URL_BULK, data=body) as response:
+                    status = response.status
+                    if status == 200:
+                        # The endpoint echoes back a status for every bar so failures can be logged individually
+                        results = orjson.loads(await response.read()).get("results", [])
+
+                if status in RETRY_STATUSES:
+                    if retries_left:
+                        logging.warning(f"Convex returned {status} for batch of {len(payloads)} bar(s), retrying...")
+                        await self._backoff(attempt)
+                        continue
+
+                    logging.warning(f"Convex returned {status} for batch of {len(payloads)} bar(s), will resend")
+                    await self._resend(payloads)
+                    return
+
+                if status != 200:
+                    logging.warning(f"Failed to ingest {len(payloads)} bar(s). Status: {status}")
+                    return
+
+                failed = [r for r in results if not r.get("ok")]
+                for result in failed:
+                    logging.warning(f"Failed to ingest bar for {result.get('stock_code')} at {result.get('timestamp')}: {result.get('error')}")
+                logging.info(f"Successfully ingested {len(payloads) - len(failed)}/{len(payloads)} bar(s)")
+                return
+
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if retries_left:
+                    logging.warning(f"HTTP request failed for batch of {len(payloads)} bar(s), retrying: {e}")
+                    await self._backoff(attempt)
+                    continue
+
+                logging.warning(f"HTTP request failed for batch of {len(payloads)} bar(s), will resend: {e}")
+                await self._resend(payloads)
+                return
+            except Exception:
+                logging.error(f"An unexpected error while uploading bars:\n{traceback.format_exc()}")
+                return
+
+    async def _resend(self, payloads):
+        """
+        Puts a batch that was never acknowledged back on the queue, to be resent once Convex
+        or the connection recovers. Re-sending is safe: the upsert is keyed on stock and timestamp.
+        """
+        await asyncio.sleep(RESEND_DELAY_SECONDS)
+        for payload in payloads:
+            self._put(payload)
+
+    @staticmethod
+    async def _backoff(attempt):
+        """
+        Sleeps before retry number attempt + 1: exponential backoff with random jitter.
+        """
+        await asyncio.sleep(RETRY_BACKOFF_SECONDS * (2 ** attempt) + random.uniform(0, RETRY_BACKOFF_SECONDS))
 
     def on_ticks(self, ticks):
         """
@@ -264,7 +686,8 @@ class Ingestor:
             logging.debug("Subscriptions still in progress, holding back tick processing...")
             return
             
-        if not is_market_open():
+        # The only clock read per callback; per-tick timestamp parsing never consults the clock
+        if not _is_market_open_at(time.time()):
             logging.debug("Market not yet open, holding back tick processing...")
             return
             
@@ -278,63 +701,40 @@ class Ingestor:
         elif isinstance(ticks, list):
             ticks_to_process = ticks
         else:
-            logging.warning(f"Received tick data in unexpected format: {type(ticks)}. Data: {ticks}")
+            logging.warning("Received tick data in unexpected format: %s. Data: %s", type(ticks), ticks)
             return
             
-        logging.info(f"Received {len(ticks_to_process)} tick(s)")
+        # Hot path: use lazy %-style arguments so messages are only formatted when the level is enabled
+        logging.debug("Received %d tick(s)", len(ticks_to_process))
 
         for tick in ticks_to_process:
-            # We only care about valid OHLCV ticks that have both 'close' and 'datetime' keys.
-            # This filters out other message types like simple quotes or confirmations.
-            if isinstance(tick, dict) and tick.get("close") and tick.get("datetime"):
-                try:
-                    # Convert the datetime string from Breeze to a Unix timestamp
-                    # Assume Breeze sends IST time and convert properly
-                    dt_obj = datetime.strptime(tick['datetime'], '%Y-%m-%d %H:%M:%S')
-                    ist_tz = pytz.timezone('Asia/Kolkata')
-                    dt_obj_ist = ist_tz.localize(dt_obj)  # Mark as IST
-                    timestamp = int(dt_obj_ist.timestamp())  # Convert to UTC timestamp
-                    
-                    stock_code = tick["stock_code"]
-                    
-                    # Check for duplicate timestamps to avoid unnecessary updates
-                    if stock_code in self.last_seen_timestamps:
-                        if timestamp <= self.last_seen_timestamps[stock_code]:
-                            logging.debug(f"Duplicate/old timestamp for {stock_code}: {timestamp}")
-                            continue
-                    
-                    self.last_seen_timestamps[stock_code] = timestamp
-                    
-                    # Prepare the data payload in the format our Convex backend expects
-                    payload = {
-                        "stock_code": stock_code,
-                        "open": float(tick["open"]),
-                        "high": float(tick["high"]),
-                        "low": float(tick["low"]),
-                        "close": float(tick["close"]),
-                        "volume": int(tick["volume"]),
-                        "interval": tick["interval"],
-                        "timestamp": timestamp,
-                    }
+            # Indexing the fields directly is the fast path for real bars; a missing key means either
+            # some other message type (no close/datetime) or an incomplete bar. Values are never
+            # truth-tested, so a 0.0 close is kept.
+            try:
+                payload = _build_payload(tick)
+            except KeyError as e:
+                if "close" in tick and "datetime" in tick:
+                    logging.warning("Skipping bar with missing field %s: %s", e, tick)
+                else:
+                    logging.debug("Skipping invalid item in tick data: %s", tick)
+                continue
+            except (TypeError, ValueError) as e:
+                logging.warning("Skipping malformed tick %s: %s", tick, e)
+                continue
 
-                    # Send the data to the Convex HTTP endpoint via a POST request
-                    response = session.post(
-                        INGEST_URL,
-                        json=payload,
-                        timeout=3,  # Reduced timeout
-                    )
-                    
-                    if response.status_code == 200:
-                        logging.info(f"Successfully ingested {payload['interval']} bar for {payload['stock_code']} at {timestamp} ({tick['datetime']})")
-                    else:
-                        logging.warning(f"Failed to ingest bar for {payload['stock_code']}. Status: {response.status_code}")
-                        
-                except requests.exceptions.RequestException as e:
-                    logging.warning(f"HTTP request failed for {tick.get('stock_code')}: {e}")
-                except Exception:
-                    logging.error(f"An unexpected error in on_ticks for {tick.get('stock_code')}:\n{traceback.format_exc()}")
-            else:
-                logging.debug(f"Skipping invalid item in tick data: {tick}")
+            stock_code = payload["stock_code"]
+            timestamp = payload["timestamp"]
+            key = (stock_code, payload["interval"])
+
+            # Skip bars Breeze replays (or delivers out of order) so they never cost an upload
+            if timestamp <= self.last_seen_timestamps.get(key, -1):
+                self.duplicate_bars += 1
+                logging.debug("Duplicate/old timestamp for %s: %d (%d skipped so far)", stock_code, timestamp, self.duplicate_bars)
+                continue
+
+            self.last_seen_timestamps[key] = timestamp
+            self._enqueue(payload)
 
     def run(self):
         while True:
@@ -348,6 +748,9 @@ class Ingestor:
                         time.sleep(60)
                         continue
                     
+                    # Download and parse the master file in the background while we authenticate and connect
+                    tokens_future = self._executor.submit(get_nse_cash_stock_tokens)
+
                     # The logical order: Generate session first, then connect to WebSocket
                     self.breeze.generate_session(api_secret=SECRET_KEY, session_token=current_token)
                     logging.info("Successfully generated Breeze API session.")
@@ -359,7 +762,7 @@ class Ingestor:
                     # Reset the flag at the start of each session
                     self.subscriptions_complete = False
                     
-                    all_tokens = get_nse_cash_stock_tokens()
+                    all_tokens = tokens_future.result()
                     if not all_tokens:
                         logging.error("No stock tokens found. Retrying in 60 seconds.")
                         time.sleep(60)
@@ -368,57 +771,64 @@ class Ingestor:
                     subscription_interval = os.getenv("BREEZE_INTERVAL", "1minute")
                     subscription_template = "4.1!"
                     
-                    # Subscribe in batches to avoid overwhelming the API
-                    batch_size = int(os.getenv("BATCH_SIZE", "25"))
+                    # Subscriptions run concurrently, gated by a token bucket that honours the API rate
+                    # limit: SUBSCRIPTION_DELAY seconds per call on average, in bursts of up to BATCH_SIZE.
+                    batch_size = max(1, int(os.getenv("BATCH_SIZE", "25")))
                     subscription_delay = float(os.getenv("SUBSCRIPTION_DELAY", "0.1"))
+                    subscription_workers = max(1, int(os.getenv("SUBSCRIPTION_WORKERS", "8")))
+                    limiter = _TokenBucket(1 / subscription_delay, batch_size) if subscription_delay > 0 else None
                     
                     if not is_market_open():
                         logging.info("🌅 PRE-MARKET: Starting subscriptions before market opens at 9:15 AM...")
                     
-                    logging.info(f"Subscribing to {len(all_tokens)} stocks in batches of {batch_size}...")
+                    logging.info(f"Subscribing to {len(all_tokens)} stocks with {subscription_workers} workers in bursts of {batch_size}...")
                     logging.info("📵 Tick processing is PAUSED until subscriptions complete AND market opens...")
-                    
-                    successful_subscriptions = 0
-                    
-                    for i, token in enumerate(all_tokens):
+
+                    # Build every subscription string once up front instead of formatting per iteration
+                    all_subs = [subscription_template + str(token) for token in all_tokens]
+
+                    def subscribe_one(indexed_token):
+                        i, stock_token = indexed_token
+                        if limiter:
+                            limiter.acquire()
                         try:
-                            stock_token = f"{subscription_template}{token}"
                             self.breeze.subscribe_feeds(stock_token=stock_token, interval=subscription_interval)
-                            successful_subscriptions += 1
-                            logging.info(f"({i+1}/{len(all_tokens)}) ✓ Subscribed to {stock_token} for {subscription_interval} OHLCV.")
+                            logging.info(f"({i+1}/{len(all_subs)}) ✓ Subscribed to {stock_token} for {subscription_interval} OHLCV.")
+                            return True
                         except Exception as e:
-                            logging.error(f"✗ Failed to subscribe to {subscription_template}{token}: {e}")
-                        
-                        # Add delay between subscriptions to be respectful to the API
-                        time.sleep(subscription_delay)
-                        
-                        # Every batch, check if we're still connected
-                        if (i + 1) % batch_size == 0:
-                            logging.info(f"Completed batch {(i + 1) // batch_size}. Pausing briefly...")
-                            time.sleep(2)  # Brief pause between batches
+                            logging.error(f"✗ Failed to subscribe to {stock_token}: {e}")
+                            return False
+
+                    # The first subscribe_feeds call sets up breeze_connect's WebSocket handlers, which
+                    # is not safe to race, so make it on this thread before fanning out to the pool.
+                    indexed_subs = enumerate(all_subs)
+                    successful_subscriptions = 0
+                    first_sub = next(indexed_subs, None)
+                    if first_sub is not None and subscribe_one(first_sub):
+                        successful_subscriptions += 1
+                    with ThreadPoolExecutor(max_workers=subscription_workers, thread_name_prefix="subscribe") as pool:
+                        successful_subscriptions += sum(pool.map(subscribe_one, indexed_subs))
 
                     # All subscriptions complete
                     self.subscriptions_complete = True
                     logging.info(f"🎯 All subscriptions complete! Successfully subscribed to {successful_subscriptions}/{len(all_tokens)} stocks.")
                     
-                    # Wait for market to actually open if we're early
-                    while is_market_session_time() and not is_market_open():
-                        tz = pytz.timezone('Asia/Kolkata')
-                        now = datetime.now(tz)
-                        market_open_time = now.replace(hour=9, minute=15, second=0, microsecond=0)
-                        wait_seconds = (market_open_time - now).total_seconds()
-                        if wait_seconds > 0:
-                            logging.info(f"⏰ Subscriptions ready! Waiting {wait_seconds:.0f} seconds for market to open at 9:15 AM...")
-                            time.sleep(min(60, wait_seconds))  # Check every minute or until market opens
-                        else:
-                            break
-                    
+                    # Wait for market to actually open if we're early, sleeping straight through to 9:15 AM
+                    now = time.time()
+                    _, _, _, _, market_open, _, session_end = _market_bounds(now)
+                    if now < market_open:
+                        wait_seconds = market_open - now
+                        logging.info(f"⏰ Subscriptions ready! Waiting {wait_seconds:.0f} seconds for market to open at 9:15 AM...")
+                        time.sleep(wait_seconds)
+
                     if is_market_open():
                         logging.info("📡 Market is OPEN! Tick processing is now ENABLED - data will be ingested and stored.")
 
+                    # Nothing to do on this thread until the session ends, so sleep until then in one go.
+                    # The loop only guards against waking a moment early, which would otherwise start a new session.
                     logging.info("Running until session ends...")
                     while is_market_session_time():
-                        time.sleep(60) # Keep the script alive, checking every minute.
+                        time.sleep(max(1, session_end - time.time()))
 
                     logging.info("Trading session ended. Disconnecting WebSocket.")
                     self.breeze.ws_disconnect()
@@ -432,8 +842,7 @@ class Ingestor:
                 if next_opening:
                     # Adjust to start session 15 minutes earlier
                     next_session_start = next_opening.replace(hour=9, minute=0)
-                    tz = pytz.timezone('Asia/Kolkata')
-                    now = datetime.now(tz)
+                    now = datetime.now(IST)
                     sleep_seconds = (next_session_start - now).total_seconds()
                     
                     if sleep_seconds > 0:
@@ -4,6 +4,27 @@ import { api } from "./_generated/api";
 
 const http = httpRouter();
 
+function isFiniteNumber(value: unknown): value is number {
+  return typeof value === 'number' && Number.isFinite(value);
+}
+
+// Checks every field of an incoming bar against the shape updateOhlcvBulk expects
+// and returns a clean copy, or null if any field is missing or not a finite number.
+function toValidBar(value: unknown) {
+  if (typeof value !== 'object' || value === null) {
+    return null;
+  }
+  const { stock_code, open, high, low, close, volume, interval, timestamp } = value as Record<string, unknown>;
+  if (typeof stock_code !== 'string' || !stock_code || typeof interval !== 'string') {
+    return null;
+  }
+  if (!isFiniteNumber(open) || !isFiniteNumber(high) || !isFiniteNumber(low) || !isFiniteNumber(close)
+      || !isFiniteNumber(volume) || !isFiniteNumber(timestamp)) {
+    return null;
+  }
+  return { stock_code, open, high, low, close, volume, interval, timestamp };
+}
+
 // Define an HTTP endpoint to receive OHLCV bars from our Python service
 http.route({
   path: "/ingestOhlcv",
@@ -33,6 +54,52 @@ http.route({
   }),
 });
 
+// Define an HTTP endpoint to receive a batch of OHLCV bars in a single request.
+// Expects a body of the form { "bars": [bar, ...] } and answers with a per-bar
+// status list so the ingestor can log individual failures.
+http.route({
+  path: "/ingestOhlcvBulk",
+  method: "POST",
+  handler: httpAction(async (ctx, request) => {
+    try {
+      const { bars } = await request.json();
+
+      if (!Array.isArray(bars)) {
+        console.error("Invalid bulk data received:", bars);
+        return new Response("Invalid data format", { status: 400 });
+      }
+
+      // Validate every field of each bar up front, so one bad bar is reported back
+      // instead of failing argument validation for the whole mutation
+      const validBars = [];
+      const results = [];
+      for (const bar of bars) {
+        const validBar = toValidBar(bar);
+        if (validBar === null) {
+          console.error("Invalid bar data received:", bar);
+          results.push({ stock_code: bar?.stock_code ?? null, timestamp: bar?.timestamp ?? null, ok: false, error: "Invalid data format" });
+        } else {
+          validBars.push(validBar);
+        }
+      }
+
+      if (validBars.length > 0) {
+        results.push(...await ctx.runMutation(api.ohlcv.updateOhlcvBulk, { bars: validBars }));
+      }
+
+      console.log(`Processed bulk ingest of ${bars.length} bar(s), ${validBars.length} valid`);
+
+      return new Response(JSON.stringify({ results }), {
+        status: 200,
+        headers: { "Content-Type": "application/json" }
+      });
+    } catch (error) {
+      console.error("Error processing OHLCV bulk ingest:", error);
+      return new Response("Internal server error", { status: 500 });
+    }
+  }),
+});
+
 // Define an HTTP endpoint to update the session token
 http.route({
   path: "/updateToken",
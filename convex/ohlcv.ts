@@ -1,50 +1,85 @@
-import { mutation, query } from "./_generated/server";
-import { v } from "convex/values";
+import { mutation, query, MutationCtx } from "./_generated/server";
+import { v, Infer } from "convex/values";
 
-// Mutation to add or update the latest OHLCV bar for a stock.
+// Shape of a single OHLCV bar as sent by the Python ingestor.
+const ohlcvBar = v.object({
+  stock_code: v.string(),
+  open: v.number(),
+  high: v.number(),
+  low: v.number(),
+  close: v.number(),
+  volume: v.number(),
+  interval: v.string(),
+  timestamp: v.number(),
+});
+
+type OhlcvBar = Infer<typeof ohlcvBar>;
+
+// Add or update the latest OHLCV bar for a stock.
 // This is an "upsert" operation with better duplicate handling.
+async function upsertBar(ctx: MutationCtx, bar: OhlcvBar) {
+  // Look for existing documents for this stock_code using the index.
+  const existingDocs = await ctx.db
+    .query("ohlcv")
+    .withIndex("by_stock_code", (q) => q.eq("stock_code", bar.stock_code))
+    .collect();
+
+  if (existingDocs.length > 1) {
+    // Clean up duplicates - keep the one with the latest timestamp and delete others
+    const sortedDocs = existingDocs.sort((a, b) => b.timestamp - a.timestamp);
+    const latestDoc = sortedDocs[0];
+
+    // Delete duplicates
+    for (let i = 1; i < sortedDocs.length; i++) {
+      await ctx.db.delete(sortedDocs[i]._id);
+    }
+
+    // Update the latest document if the new data is newer
+    if (bar.timestamp > latestDoc.timestamp) {
+      await ctx.db.patch(latestDoc._id, bar);
+    }
+  } else if (existingDocs.length === 1) {
+    const existing = existingDocs[0];
+    // Only update if the new timestamp is newer or equal (to handle updates to the same bar)
+    if (bar.timestamp >= existing.timestamp) {
+      await ctx.db.patch(existing._id, bar);
+    }
+  } else {
+    // If it doesn't exist, insert a new document.
+    await ctx.db.insert("ohlcv", bar);
+  }
+}
+
+// Mutation to add or update the latest OHLCV bar for a stock.
 export const updateOhlcv = mutation({
+  args: ohlcvBar.fields,
+  handler: async (ctx, args) => {
+    await upsertBar(ctx, args);
+  },
+});
+
+// Mutation to upsert a batch of OHLCV bars in a single transaction.
+// Returns a per-bar status so the ingestor can log individual failures.
+export const updateOhlcvBulk = mutation({
   args: {
-    stock_code: v.string(),
-    open: v.number(),
-    high: v.number(),
-    low: v.number(),
-    close: v.number(),
-    volume: v.number(),
-    interval: v.string(),
-    timestamp: v.number(),
+    bars: v.array(ohlcvBar),
   },
   handler: async (ctx, args) => {
-    // Look for existing documents for this stock_code using the index.
-    const existingDocs = await ctx.db
-      .query("ohlcv")
-      .withIndex("by_stock_code", (q) => q.eq("stock_code", args.stock_code))
-      .collect();
-
-    if (existingDocs.length > 1) {
-      // Clean up duplicates - keep the one with the latest timestamp and delete others
-      const sortedDocs = existingDocs.sort((a, b) => b.timestamp - a.timestamp);
-      const latestDoc = sortedDocs[0];
-      
-      // Delete duplicates
-      for (let i = 1; i < sortedDocs.length; i++) {
-        await ctx.db.delete(sortedDocs[i]._id);
-      }
-      
-      // Update the latest document if the new data is newer
-      if (args.timestamp > latestDoc.timestamp) {
-        await ctx.db.patch(latestDoc._id, args);
-      }
-    } else if (existingDocs.length === 1) {
-      const existing = existingDocs[0];
-      // Only update if the new timestamp is newer or equal (to handle updates to the same bar)
-      if (args.timestamp >= existing.timestamp) {
-      await ctx.db.patch(existing._id, args);
+    const results = [];
+    for (const bar of args.bars) {
+      try {
+        await upsertBar(ctx, bar);
+        results.push({ stock_code: bar.stock_code, timestamp: bar.timestamp, ok: true });
+      } catch (error) {
+        results.push({
+          stock_code: bar.stock_code,
+          timestamp: bar.timestamp,
+          ok: false,
+          error: String(error),
+        });
       }
-    } else {
-      // If it doesn't exist, insert a new document.
-      await ctx.db.insert("ohlcv", args);
     }
+    return results;
   },
 });
 